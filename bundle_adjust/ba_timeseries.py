@@ -11,37 +11,122 @@ The data is prepared to feed a bundle adjustment pipeline and correct the camera
 """
 
 
+import datetime
+import functools
+import heapq
 import numpy as np
 import os
+import re
 import sys
 import timeit
-import glob
+import rasterio
 import rpcm
 import json
 import shutil
 
 from bundle_adjust import loader, ba_utils, geo_utils, cam_utils
 from bundle_adjust.ba_pipeline import BundleAdjustmentPipeline
+from bundle_adjust.feature_tracks.ft_utils import init_feature_tracks_config
 from bundle_adjust.loader import flush_print
 
 
+# filename conventions from which the acquisition date can be read without opening the geotiff
+# the date patterns are non-greedy and searched in the basename, so they fail fast without backtracking
+PHR_FNAME_RE = re.compile(r"IMG_PHR[^/]*?_(\d{14,20})_SEN_")
+PNEO_FNAME_RE = re.compile(r"IMG_P[^/]*?_(\d{14,20})_PAN_SEN_")
+SKYSAT_FNAME_RE = re.compile(r"^(\d{8}_\d{6})")
+
+# fixed-width datetime formats that parse_datetime reads without strptime
+# each format is mapped to a regex capturing year, month, day, hour, minute, second (and fraction of second)
+FAST_DATETIME_FORMATS = {
+    "%Y%m%d%H%M%S%f": re.compile(r"^(\d{4})(\d{2})(\d{2})(\d{2})(\d{2})(\d{2})(\d{1,6})$"),
+    "%Y%m%d%H%M%S": re.compile(r"^(\d{4})(\d{2})(\d{2})(\d{2})(\d{2})(\d{2})$"),
+    "%Y%m%d_%H%M%S": re.compile(r"^(\d{4})(\d{2})(\d{2})_(\d{2})(\d{2})(\d{2})$"),
+    "%Y:%m:%d %H:%M:%S": re.compile(r"^(\d{4}):(\d{2}):(\d{2}) (\d{2}):(\d{2}):(\d{2})$"),
+    "%Y-%m-%d %H:%M:%S.%f": re.compile(r"^(\d{4})-(\d{2})-(\d{2}) (\d{2}):(\d{2}):(\d{2})\.(\d{1,6})$"),
+}
+
+
+def parse_datetime(date_string, date_format):
+    """
+    Equivalent to datetime.datetime.strptime(date_string, date_format), but faster for FAST_DATETIME_FORMATS
+    strptime is still used if date_string does not have the exact fixed-width shape of the format
+    """
+    m = FAST_DATETIME_FORMATS[date_format].match(date_string) if date_format in FAST_DATETIME_FORMATS else None
+    if m is None:
+        return datetime.datetime.strptime(date_string, date_format)
+    fields = m.groups()
+    microsecond = int(fields[6].ljust(6, "0")) if len(fields) > 6 else 0
+    return datetime.datetime(*[int(x) for x in fields[:6]], microsecond)
+
+
+def get_acquisition_date_from_filename(geotiff_path):
+    """
+    Reads the acquisition date of a geotiff from its filename, following the naming conventions
+    of Pleiades (IMG_PHR...), Pleiades Neo (IMG_P..._PAN_SEN_...) and Skysat (YYYYmmdd_HHMMSS_...)
+    Returns None if the filename does not follow any of these conventions
+    """
+    basename = os.path.basename(geotiff_path)
+    for fname_re in [PHR_FNAME_RE, PNEO_FNAME_RE]:
+        m = fname_re.search(basename)
+        if m is not None:
+            # 14-digit stamps have no fraction of second, strptime would read them wrongly with %f
+            date_format = "%Y%m%d%H%M%S" if len(m.group(1)) == 14 else "%Y%m%d%H%M%S%f"
+            return parse_datetime(m.group(1), date_format)
+    m = SKYSAT_FNAME_RE.match(basename)
+    if m is not None:
+        return parse_datetime(m.group(1), "%Y%m%d_%H%M%S")
+    return None
+
+
 def get_acquisition_date(geotiff_path):
     """
     Reads the acquisition date of a geotiff
+    Results are cached, the modification time of the file is part of the key to detect changes
     """
-    import datetime
-    import rasterio
+    return read_acquisition_date(geotiff_path, os.path.getmtime(geotiff_path))
+
+
+@functools.lru_cache(maxsize=None)
+def read_acquisition_date(geotiff_path, mtime):
+    """
+    Reads the acquisition date of a geotiff (mtime is not used, it is only part of the cache key)
+    The filename is checked first, then the TIFFTAG_DATETIME tag is read directly from the tiff header
+    The geotiff is only opened with rasterio if none of the previous options worked
+    """
+    dt = get_acquisition_date_from_filename(geotiff_path)
+    if dt is not None:
+        return dt
+
+    tiff_tags = loader.read_tiff_tags(geotiff_path, [306])  # 306 = TIFFTAG_DATETIME
+    if 306 in tiff_tags:
+        return parse_datetime(tiff_tags[306], "%Y:%m:%d %H:%M:%S")
 
     with rasterio.open(geotiff_path) as src:
-        if "TIFFTAG_DATETIME" in src.tags().keys():
-            date_string = src.tags()["TIFFTAG_DATETIME"]
-            dt = datetime.datetime.strptime(date_string, "%Y:%m:%d %H:%M:%S")
+        date_string = src.tags().get("TIFFTAG_DATETIME")
+    if date_string is None:
+        raise ValueError("Acquisition date of {} could not be found".format(geotiff_path))
+    return parse_datetime(date_string, "%Y:%m:%d %H:%M:%S")
+
+
+def get_rpc_and_acquisition_date(geotiff_path):
+    """
+    Reads the rpc model and the acquisition date of a geotiff
+    Both are taken from a single read of the tiff header (tags 50844 and 306) whenever possible
+    """
+    tiff_tags = loader.read_tiff_tags(geotiff_path, [306, 50844])  # 306 = TIFFTAG_DATETIME, 50844 = RPC
+    if len(tiff_tags.get(50844, [])) == 92 and not loader.has_rpc_sidecar_file(geotiff_path):
+        rpc = loader.rpc_from_rpc_coefficient_tag(tiff_tags[50844])
+    else:
+        rpc = rpcm.rpc_from_geotiff(geotiff_path)
+
+    dt = get_acquisition_date_from_filename(geotiff_path)
+    if dt is None:
+        if 306 in tiff_tags:
+            dt = parse_datetime(tiff_tags[306], "%Y:%m:%d %H:%M:%S")
         else:
-            # temporary fix in case the previous tag is missing
-            # get datetime from skysat geotiff identifier
-            date_string = os.path.basename(geotiff_path)[:15]
-            dt = datetime.datetime.strptime(date_string, "%Y%m%d_%H%M%S")
-    return dt
+            dt = get_acquisition_date(geotiff_path)
+    return rpc, dt
 
 
 def group_files_by_date(datetimes, image_fnames):
@@ -51,53 +136,37 @@ def group_files_by_date(datetimes, image_fnames):
     Each timeline instance is a group of images with a common acquisition date (i.e. less than 30 mins difference)
     """
 
-    def dt_diff_in_mins(d1, d2):
-        return abs((d1 - d2).total_seconds() / 60.0)
-
     # sort images according to the acquisition date
-    sorted_indices = np.argsort(datetimes)
-    sorted_datetimes = np.array(datetimes)[sorted_indices].tolist()
-    sorted_fnames = np.array(image_fnames)[sorted_indices].tolist()
+    sorted_indices = sorted(range(len(datetimes)), key=datetimes.__getitem__)
+    sorted_datetimes = [datetimes[i] for i in sorted_indices]
     margin = 30  # maximum acquisition time difference allowed, in minutes, within a timeline instance
 
+    # acquisition times are converted once to integer microseconds, so that differences are integer subtractions
+    sorted_times = np.array(sorted_datetimes, dtype="datetime64[us]").astype(np.int64).tolist()
+    margin_in_us = margin * 60 * 10 ** 6
+
     # build timeline
-    d = {}
-    dates_already_seen = []
-    for im_idx, fname in enumerate(sorted_fnames):
-
-        new_date = True
-        current_dt = sorted_datetimes[im_idx]
-        diff_wrt_prev_dates_in_mins = [dt_diff_in_mins(x, current_dt) for x in dates_already_seen]
-
-        if len(diff_wrt_prev_dates_in_mins) > 0:
-            min_pos = np.argmin(diff_wrt_prev_dates_in_mins)
-
-            # if this image was acquired within 30 mins of difference w.r.t to an already seen date,
-            # then it is part of the same acquisition
-            if diff_wrt_prev_dates_in_mins[min_pos] < margin:
-                ref_date_id = dates_already_seen[min_pos].strftime("%Y%m%d_%H%M%S")
-                d[ref_date_id].append(im_idx)
-                new_date = False
-
-        if new_date:
-            date_id = sorted_datetimes[im_idx].strftime("%Y%m%d_%H%M%S")
-            d[date_id] = [im_idx]
-            dates_already_seen.append(sorted_datetimes[im_idx])
-
-    timeline = []
-    for k in d.keys():
-        current_datetime = sorted_datetimes[d[k][0]]
-        im_fnames_current_datetime = np.array(sorted_fnames)[d[k]].tolist()
-        timeline.append(
-            {
-                "datetime": current_datetime,
-                "id": k.split("/")[-1],
-                "fnames": im_fnames_current_datetime,
-                "n_images": len(d[k]),
-                "adjusted": False,
-                "image_weights": [],
-            }
-        )
+    # dates are sorted, so the closest already seen date is always the reference date of the last group
+    timeline, ref_time = [], None
+    for im_idx, current_time in zip(sorted_indices, sorted_times):
+
+        # if this image was acquired within 30 mins of difference w.r.t the reference date of the last group,
+        # then it is part of the same acquisition
+        if ref_time is not None and current_time - ref_time < margin_in_us:
+            timeline[-1]["fnames"].append(image_fnames[im_idx])
+            timeline[-1]["n_images"] += 1
+        else:
+            ref_time = current_time
+            timeline.append(
+                {
+                    "datetime": datetimes[im_idx],
+                    "id": datetimes[im_idx].strftime("%Y%m%d_%H%M%S"),
+                    "fnames": [image_fnames[im_idx]],
+                    "n_images": 1,
+                    "adjusted": False,
+                    "image_weights": [],
+                }
+            )
     return timeline
 
 
@@ -106,6 +175,27 @@ class Error(Exception):
 
 
 class Scene:
+
+    # valid values of ba_method, with the name of the method that runs each of them and the messages it prints
+    BA_METHODS = {
+        "ba_sequential": (
+            "run_sequential_bundle_adjustment",
+            ["\nRunning sequential bundle adjustment !", "Each date aligned with {} previous date(s)\n"],
+        ),
+        "ba_global": (
+            "run_global_bundle_adjustment",
+            [
+                "\nRunning global bundle ajustment !",
+                "All dates will be adjusted together at once",
+                "Track pairs restricted to the same date and the next {} dates\n",
+            ],
+        ),
+        "ba_bruteforce": (
+            "run_bruteforce_bundle_adjustment",
+            ["\nRunning bruteforce bundle ajustment !", "All dates will be adjusted together at once\n"],
+        ),
+    }
+
     def __init__(self, scene_config):
 
         t0 = timeit.default_timer()
@@ -149,8 +239,6 @@ class Scene:
         self.init_ba_input_data()
 
         # feature tracks configuration
-        from .feature_tracks.ft_utils import init_feature_tracks_config
-
         self.tracks_config = init_feature_tracks_config()
         for k in self.tracks_config.keys():
             if k in args.keys():
@@ -169,6 +257,7 @@ class Scene:
 
         # construct scene timeline
         self.aoi_lonlat = None
+        self.rpcs_init_cache = {}
         self.timeline = self.load_scene()
         # if aoi_geojson is not defined in ba_config define aoi_lonlat as the union of all geotiff footprints
         if "aoi_geojson" in args.keys():
@@ -183,35 +272,98 @@ class Scene:
         print("Scene loaded in {:.2f} seconds".format(timeit.default_timer() - t0))
         flush_print("\n###################################################################################\n\n")
 
-    def load_scene(self):
-
-        all_im_fnames = []
-        all_im_rpcs = []
-        all_im_datetimes = []
+    def load_image_metadata(self, tif_fname):
+        """
+        Loads the rpc model and the acquisition date of a geotiff
+        """
+        if self.rpc_src == "geotiff":
+            return get_rpc_and_acquisition_date(tif_fname)
+
+        # load rpc
+        f_id = loader.get_id(tif_fname)
+        if self.rpc_src == "json":
+            with open(os.path.join(self.rpc_dir, f_id + ".json")) as f:
+                d = json.load(f)
+            rpc = rpcm.RPCModel(d, dict_format="rpcm")
+        elif self.rpc_src == "txt":
+            rpc = rpcm.rpc_from_rpc_file(os.path.join(self.rpc_dir, f_id + ".rpc"))
+        else:
+            raise ValueError("Unknown rpc_src value: {}".format(self.rpc_src))
 
-        geotiff_paths = sorted(glob.glob(os.path.join(self.geotiff_dir, "**/*.tif"), recursive=True))
-        if self.geotiff_label is not None:
-            geotiff_paths = [os.path.basename(fn) for fn in geotiff_paths if self.geotiff_label in fn]
+        return rpc, get_acquisition_date(tif_fname)
 
-        for tif_fname in geotiff_paths:
+    def get_metadata_signature(self, tif_fname):
+        """
+        Returns the name, modification time and size of the files from which the metadata of a geotiff is loaded
+        With rpc_src "geotiff" these include the sidecar rpc files, since GDAL reads them instead of the tiff tags
+        """
+        paths = [tif_fname]
+        if self.rpc_src == "geotiff":
+            paths.extend(loader.find_rpc_sidecar_files(tif_fname))
+        elif self.rpc_src == "json":
+            paths.append(os.path.join(self.rpc_dir, loader.get_id(tif_fname) + ".json"))
+        elif self.rpc_src == "txt":
+            paths.append(os.path.join(self.rpc_dir, loader.get_id(tif_fname) + ".rpc"))
+        return [[os.path.basename(p), os.path.getmtime(p), os.path.getsize(p)] for p in paths]
+
+    def save_scene_index(self, index_path, geotiff_paths, signatures, metadata):
+        """
+        Writes the rpcs and acquisition dates of a list of geotiffs to a scene index (.json file)
+        """
+        index = {"rpc_src": self.rpc_src, "rpc_dir": self.rpc_dir, "images": []}
+        for fn, signature, (rpc, dt) in zip(geotiff_paths, signatures, metadata):
+            to_write = {
+                "fname": fn,
+                "signature": signature,
+                "datetime": dt.strftime("%Y-%m-%d %H:%M:%S.%f"),
+                "rpc": rpc.__dict__,
+            }
+            index["images"].append(to_write)
+        loader.save_dict_to_json(index, index_path)
 
-            f_id = loader.get_id(tif_fname)
+    def load_scene_index(self, index_path, geotiff_paths, signatures):
+        """
+        Reads the rpcs and acquisition dates of a list of geotiffs from a scene index (.json file)
+        Returns None if the index does not exist or if it does not match the current geotiffs and rpc files
+        """
+        if not os.path.exists(index_path):
+            return None
+
+        # a malformed index (e.g. truncated or edited by hand) is treated as if it did not exist
+        try:
+            index = loader.load_dict_from_json(index_path)
+            if index["rpc_src"] != self.rpc_src or index["rpc_dir"] != self.rpc_dir:
+                return None
+            images = index["images"]
+            if [d["fname"] for d in images] != geotiff_paths or [d["signature"] for d in images] != signatures:
+                return None
+
+            metadata = []
+            for d in images:
+                rpc = rpcm.RPCModel(d["rpc"], dict_format="rpcm")
+                dt = parse_datetime(d["datetime"], "%Y-%m-%d %H:%M:%S.%f")
+                metadata.append((rpc, dt))
+        except (ValueError, KeyError, TypeError, AttributeError):
+            return None
+        print("Geotiff metadata loaded from {}".format(index_path))
+        return metadata
 
-            # load rpc
-            if self.rpc_src == "geotiff":
-                rpc = rpcm.rpc_from_geotiff(tif_fname)
-            elif self.rpc_src == "json":
-                with open(os.path.join(self.rpc_dir, f_id + ".json")) as f:
-                    d = json.load(f)
-                rpc = rpcm.RPCModel(d, dict_format="rpcm")
-            elif self.rpc_src == "txt":
-                rpc = rpcm.rpc_from_rpc_file(os.path.join(self.rpc_dir, f_id + ".rpc"))
-            else:
-                raise ValueError("Unknown rpc_src value: {}".format(self.rpc_src))
+    def load_scene(self):
 
-            all_im_fnames.append(tif_fname)
-            all_im_rpcs.append(rpc)
-            all_im_datetimes.append(get_acquisition_date(tif_fname))
+        geotiff_paths = sorted(loader.find_files(self.geotiff_dir, ".tif", label=self.geotiff_label))
+        self.geotiff_path_by_id = {loader.get_id(fn): fn for fn in geotiff_paths}
+
+        # the metadata of the geotiffs is reused from the scene index if none of the input files changed
+        index_path = os.path.join(self.dst_dir, "scene_index.json")
+        signatures = [self.get_metadata_signature(fn) for fn in geotiff_paths]
+        metadata = self.load_scene_index(index_path, geotiff_paths, signatures)
+        if metadata is None:
+            # metadata reading is I/O bound, so the geotiffs are read by a pool of threads (map preserves the order)
+            metadata = loader.map_in_threads(self.load_image_metadata, geotiff_paths)
+            self.save_scene_index(index_path, geotiff_paths, signatures, metadata)
+        all_im_fnames = geotiff_paths
+        all_im_rpcs = [rpc for rpc, _ in metadata]
+        all_im_datetimes = [dt for _, dt in metadata]
 
         # copy initial rpcs
         init_rpcs_dir = os.path.join(self.dst_dir, "rpcs_init")
@@ -228,53 +380,31 @@ class Scene:
         Displays the value of certain attributes at some indices of the timeline in a scene to bundle adjust
         """
 
-        max_lens = np.zeros(len(attributes)).tolist()
-        for idx in timeline_indices:
-            to_display = ""
-            for a_idx, a in enumerate(attributes):
-                string_len = len("{}".format(self.timeline[idx][a]))
-                if max_lens[a_idx] < string_len:
-                    max_lens[a_idx] = string_len
-        max_len_idx = max([len(str(idx)) for idx in timeline_indices])
-        index_str = "index"
-        margin = max_len_idx - len(index_str)
-        header_values = [index_str + " " * margin] if margin > 0 else [index_str]
-        for a_idx, a in enumerate(attributes):
-            margin = max_lens[a_idx] - len(a)
-            header_values.append(a + " " * margin if margin > 0 else a)
-        header_row = "  |  ".join(header_values)
-        print(header_row)
-        print("_" * len(header_row) + "\n")
-        for idx in timeline_indices:
-            margin = len(header_values[0]) - len(str(idx))
-            to_display = [str(idx) + " " * margin if margin > 0 else str(idx)]
-            for a_idx, a in enumerate(attributes):
-                a_value = "{}".format(self.timeline[idx][a])
-                margin = len(header_values[a_idx + 1]) - len(a_value)
-                to_display.append(a_value + " " * margin if margin > 0 else a_value)
-            print("  |  ".join(to_display))
+        # format each cell once and derive the column widths from the formatted strings
+        cells = [["{}".format(self.timeline[idx][a]) for a in attributes] for idx in timeline_indices]
+        widths = [max([len("index")] + [len(str(idx)) for idx in timeline_indices])]
+        widths += [max([len(a)] + [len(row[a_idx]) for row in cells]) for a_idx, a in enumerate(attributes)]
+        row_format = "  |  ".join(["{:<%d}" % w for w in widths])
 
+        # all rows are joined and printed at once
+        header_row = row_format.format("index", *attributes)
+        lines = [header_row, "_" * len(header_row) + "\n"]
+        lines += [row_format.format(idx, *row) for idx, row in zip(timeline_indices, cells)]
         if "n_images" in attributes:  # add total number of images
-            print("_" * len(header_row) + "\n")
-            to_display = [" " * len(header_values[0])]
-            for a_idx, a in enumerate(attributes):
-                if a == "n_images":
-                    a_value = "{} total".format(sum([self.timeline[idx]["n_images"] for idx in timeline_indices]))
-                    margin = len(header_values[a_idx + 1]) - len(a_value)
-                    to_display.append(a_value + " " * margin if margin > 0 else a_value)
-                else:
-                    to_display.append(" " * len(header_values[a_idx + 1]))
-            print("     ".join(to_display))
-        print("\n")
+            lines.append("_" * len(header_row) + "\n")
+            n_total = sum([self.timeline[idx]["n_images"] for idx in timeline_indices])
+            totals = ["{} total".format(n_total) if a == "n_images" else "" for a in attributes]
+            lines.append("     ".join(["{:<{w}}".format(c, w=w) for c, w in zip([""] + totals, widths)]))
+        print("\n".join(lines + ["\n"]))
 
     def check_adjusted_dates(self, input_dir, t_idx):
 
         prev_adj_data_found = False
         dir_adj_rpc = os.path.join(input_dir, "rpcs_adj")
         if os.path.isdir(dir_adj_rpc):
-            adj_fnames = []
-            for adj_id in [loader.get_id(p) for p in glob.glob(dir_adj_rpc + "/*.rpc_adj")]:
-                adj_fnames.extend(glob.glob(os.path.join(self.geotiff_dir, "**/" + adj_id + ".tif"), recursive=True))
+            with os.scandir(dir_adj_rpc) as it:
+                adj_ids = [loader.get_id(entry.name) for entry in it if entry.name.endswith(".rpc_adj")]
+            adj_fnames = [self.geotiff_path_by_id[adj_id] for adj_id in adj_ids if adj_id in self.geotiff_path_by_id]
             print("Found {} previously adjusted images in {}\n".format(len(adj_fnames), self.dst_dir))
 
             datetimes_adj = [get_acquisition_date(img_geotiff_path) for img_geotiff_path in adj_fnames]
@@ -324,8 +454,7 @@ class Scene:
         if found_adj_dates:
             # load data from closest date in time
             all_prev_adj_t_indices = [idx for idx, d in enumerate(self.timeline) if d["adjusted"]]
-            closest_adj_t_indices = sorted(all_prev_adj_t_indices, key=lambda x: abs(x - t_idx))
-            adj_t_indices_to_use = closest_adj_t_indices[:previous_dates]
+            adj_t_indices_to_use = heapq.nsmallest(previous_dates, all_prev_adj_t_indices, key=lambda x: abs(x - t_idx))
             adj_dates_to_use = ", ".join([dt2str(self.timeline[k]["datetime"]) for k in adj_t_indices_to_use])
             print("Using {} previously adjusted date(s): {}\n".format(len(adj_t_indices_to_use), adj_dates_to_use))
             self.load_data_from_dates(adj_t_indices_to_use, input_dir, adjusted=True)
@@ -354,8 +483,6 @@ class Scene:
 
     def bundle_adjust(self, feature_detection=True):
 
-        import timeit
-
         t0 = timeit.default_timer()
 
         extra_ba_config = {}
@@ -436,16 +563,16 @@ class Scene:
         flush_print("Average BA iterations per date: {}".format(int(np.ceil(np.mean(ba_iters_per_date)))))
         flush_print("\nTOTAL TIME: {}\n".format(loader.get_time_in_hours_mins_secs(total_time)))
 
-    def run_global_bundle_adjustment(self):
-
+    def run_joint_bundle_adjustment(self, predefined_pairs):
+        """
+        Adjusts all selected dates together at once
+        predefined_pairs is the list of image pairs allowed for feature tracking (all pairs are used if it is empty)
+        """
         ba_dir = os.path.join(self.dst_dir, self.ba_method)
         os.makedirs(ba_dir, exist_ok=True)
 
-        # only pairs from the same date or consecutive dates are allowed
-        args = [self.timeline, self.selected_timeline_indices, self.n_dates]
-        self.tracks_config["FT_predefined_pairs"] = ba_utils.load_pairs_from_same_date_and_next_dates(*args)
-
         # load bundle adjustment data and run bundle adjustment
+        self.tracks_config["FT_predefined_pairs"] = predefined_pairs
         self.set_ba_input_data(self.selected_timeline_indices, ba_dir, ba_dir, 0)
         running_time, time_FT, n_tracks, ba_e, init_e = self.bundle_adjust()
         if self.remove_FT_files:
@@ -458,59 +585,63 @@ class Scene:
         flush_print("Total BA iterations: {}".format(int(self.ba_pipeline.ba_iters)))
         flush_print("\nTOTAL TIME: {}\n".format(loader.get_time_in_hours_mins_secs(running_time)))
 
-    def run_bruteforce_bundle_adjustment(self):
-
-        ba_dir = os.path.join(self.dst_dir, self.ba_method)
-        os.makedirs(ba_dir, exist_ok=True)
+    def run_global_bundle_adjustment(self):
 
-        self.tracks_config["FT_predefined_pairs"] = []
-        self.set_ba_input_data(self.selected_timeline_indices, ba_dir, ba_dir, 0)
-        running_time, time_FT, n_tracks, ba_e, init_e = self.bundle_adjust()
-        if self.remove_FT_files:
-            self.rm_tmp_files_after_ba()
+        # only pairs from the same date or consecutive dates are allowed
+        args = [self.timeline, self.selected_timeline_indices, self.n_dates]
+        self.run_joint_bundle_adjustment(ba_utils.load_pairs_from_same_date_and_next_dates(*args))
 
-        args = [running_time, n_tracks, init_e, ba_e]
-        flush_print("All dates adjusted in {:.2f} seconds, {} ({:.3f}, {:.3f})".format(*args))
-        time_FT = loader.get_time_in_hours_mins_secs(time_FT)
-        flush_print("\nAll feature tracks constructed in {}\n".format(time_FT))
-        flush_print("Total BA iterations: {}".format(int(self.ba_pipeline.ba_iters)))
-        flush_print("\nTOTAL TIME: {}\n".format(loader.get_time_in_hours_mins_secs(running_time)))
+    def run_bruteforce_bundle_adjustment(self):
+        self.run_joint_bundle_adjustment([])
 
     def is_ba_method_valid(self, ba_method):
-        return ba_method in ["ba_global", "ba_sequential", "ba_bruteforce"]
+        return ba_method in self.BA_METHODS
 
     def compute_reprojection_error_before_and_after_bundle_adjust(self):
 
         im_fnames = [im.geotiff_path for im in self.ba_pipeline.images]
         C = self.ba_pipeline.ba_params.C
         pairs_to_triangulate = self.ba_pipeline.ba_params.pairs_to_triangulate
-        cam_model = "rpc"
 
         # get init and bundle adjusted rpcs
+        # init rpcs never change, so each of them is read from rpcs_init only once per scene
         rpcs_init_dir = os.path.join(self.dst_dir, "rpcs_init")
-        rpcs_init = loader.load_rpcs_from_dir(im_fnames, rpcs_init_dir, extension="rpc", verbose=False)
+        fnames_to_load = [fn for fn in im_fnames if fn not in self.rpcs_init_cache]
+        if len(fnames_to_load) > 0:
+            rpcs = loader.load_rpcs_from_dir(fnames_to_load, rpcs_init_dir, extension="rpc", verbose=False)
+            self.rpcs_init_cache.update(zip(fnames_to_load, rpcs))
+        rpcs_init = [self.rpcs_init_cache[fn] for fn in im_fnames]
         rpcs_ba_dir = os.path.join(self.dst_dir, self.ba_method + "/rpcs_adj")
         rpcs_ba = loader.load_rpcs_from_dir(im_fnames, rpcs_ba_dir, extension="rpc_adj", verbose=False)
 
         # triangulate
         from .feature_tracks.ft_triangulate import init_pts3d
 
-        pts3d_before = init_pts3d(C, rpcs_init, cam_model, pairs_to_triangulate, verbose=False)
-        pts3d_after = init_pts3d(C, rpcs_ba, cam_model, pairs_to_triangulate, verbose=False)
+        # the cameras are the init and bundle adjusted rpc models, so both triangulation and reprojection use rpcs
+        pts3d_before = init_pts3d(C, rpcs_init, "rpc", pairs_to_triangulate, verbose=False)
+        pts3d_after = init_pts3d(C, rpcs_ba, "rpc", pairs_to_triangulate, verbose=False)
 
         # reproject
-        n_pts, n_cam = C.shape[1], C.shape[0] // 2
-        not_nan_C = ~np.isnan(C)
-        err_before, err_after = [], []
+        # observations are flattened camera by camera (np.nonzero returns them sorted by camera index)
+        n_cam = C.shape[0] // 2
+        cam_indices, pt_indices = np.nonzero(~np.isnan(C[::2]))
+        obs2d = np.vstack((C[2 * cam_indices, pt_indices], C[2 * cam_indices + 1, pt_indices])).T
+        # the 3d points are converted to lat-lon-alt once, instead of once per camera observing them
+        latlonalt_before = cam_utils.ecef_to_latlonalt(pts3d_before)
+        latlonalt_after = cam_utils.ecef_to_latlonalt(pts3d_after)
+        pts2d_before, pts2d_after = np.zeros(obs2d.shape), np.zeros(obs2d.shape)
+        cam_bounds = np.searchsorted(cam_indices, np.arange(n_cam + 1))
         for cam_idx in range(n_cam):
-            pt_indices = np.where(not_nan_C[2 * cam_idx])[0]
-            obs2d = C[(cam_idx * 2) : (cam_idx * 2 + 2), pt_indices].T
-            pts3d_init = pts3d_before[pt_indices, :]
-            pts3d_ba = pts3d_after[pt_indices, :]
-            args = [rpcs_init[cam_idx], rpcs_ba[cam_idx], cam_model, obs2d, pts3d_init, pts3d_ba]
-            _, _, err_b, err_a, _ = ba_utils.reproject_pts3d(*args)
-            err_before.extend(err_b.tolist())
-            err_after.extend(err_a.tolist())
+            start, end = cam_bounds[cam_idx], cam_bounds[cam_idx + 1]
+            if start == end:
+                continue
+            p = pt_indices[start:end]
+            args = [*latlonalt_before, p]
+            pts2d_before[start:end] = cam_utils.apply_rpc_projection_to_latlonalt(rpcs_init[cam_idx], *args)
+            args = [*latlonalt_after, p]
+            pts2d_after[start:end] = cam_utils.apply_rpc_projection_to_latlonalt(rpcs_ba[cam_idx], *args)
+        err_before = np.linalg.norm(pts2d_before - obs2d, axis=1)
+        err_after = np.linalg.norm(pts2d_after - obs2d, axis=1)
         return np.mean(err_before), np.mean(err_after)
 
     def run_bundle_adjustment_for_RPC_refinement(self):
@@ -531,20 +662,10 @@ class Scene:
             self.reset_ba_params()
 
         # run bundle adjustment
-        if self.ba_method == "ba_sequential":
-            print("\nRunning sequential bundle adjustment !")
-            flush_print("Each date aligned with {} previous date(s)\n".format(self.n_dates))
-            self.run_sequential_bundle_adjustment()
-        elif self.ba_method == "ba_global":
-            print("\nRunning global bundle ajustment !")
-            print("All dates will be adjusted together at once")
-            flush_print("Track pairs restricted to the same date and the next {} dates\n".format(self.n_dates))
-            self.run_global_bundle_adjustment()
-        elif self.ba_method == "ba_bruteforce":
-            print("\nRunning bruteforce bundle ajustment !")
-            flush_print("All dates will be adjusted together at once\n")
-            self.run_bruteforce_bundle_adjustment()
-        else:
+        if not self.is_ba_method_valid(self.ba_method):
             print("ba_method {} is not valid !".format(self.ba_method))
-            print("accepted values are: [ba_sequential, ba_global, ba_bruteforce]")
+            print("accepted values are: [{}]".format(", ".join(self.BA_METHODS.keys())))
             sys.exit()
+        run_ba_method_name, messages = self.BA_METHODS[self.ba_method]
+        flush_print("\n".join(messages).format(self.n_dates))
+        getattr(self, run_ba_method_name)()
@@ -239,31 +239,22 @@ def load_pairs_from_same_date_and_next_dates(timeline, timeline_indices, next_da
     composed by (1) nodes that belong to the same acquisition date
                 (2) nodes between each acquisition date and the next N dates
     """
-    timeline_indices = np.array(timeline_indices)
-
-    def count_cams(timeline_indices):
-        return np.sum([timeline[t_idx]["n_images"] for t_idx in timeline_indices])
+    n_images = np.array([timeline[t_idx]["n_images"] for t_idx in timeline_indices], dtype=int)
+    offsets = np.concatenate([[0], np.cumsum(n_images)]).astype(int)
 
     # get pairs within the current date and between this date and the next
-    init_pairs, cams_so_far, dates_left = [], 0, len(timeline_indices)
-    for k, t_idx in enumerate(timeline_indices):
-        cams_current_date = timeline[t_idx]["n_images"]
+    init_pairs = [np.zeros((0, 2), dtype=int)]
+    for k in range(len(n_images)):
         if intra_date:
             # (1) pairs within the current date
-            for cam_i in np.arange(cams_so_far, cams_so_far + cams_current_date):
-                for cam_j in np.arange(cam_i + 1, cams_so_far + cams_current_date):
-                    init_pairs.append((int(cam_i), int(cam_j)))
+            init_pairs.append(np.transpose(np.triu_indices(n_images[k], k=1)) + offsets[k])
         # (2) pairs between the current date and the next N dates
-        dates_left -= 1
-        for next_date in np.arange(1, min(next_dates + 1, dates_left + 1)):
-            next_date_t_idx = timeline_indices[k + next_date]
-            cams_next_date = timeline[next_date_t_idx]["n_images"]
-            cams_until_next_date = count_cams(timeline_indices[: k + next_date])
-            for cam_i in np.arange(cams_so_far, cams_so_far + cams_current_date):
-                for cam_j in np.arange(cams_until_next_date, cams_until_next_date + cams_next_date):
-                    init_pairs.append((int(cam_i), int(cam_j)))
-        cams_so_far += cams_current_date
-    return init_pairs
+        cams_current_date = np.arange(offsets[k], offsets[k + 1])
+        for next_date_k in range(k + 1, min(k + next_dates + 1, len(n_images))):
+            cams_next_date = np.arange(offsets[next_date_k], offsets[next_date_k + 1])
+            cam_i, cam_j = np.meshgrid(cams_current_date, cams_next_date, indexing="ij")
+            init_pairs.append(np.stack([cam_i.ravel(), cam_j.ravel()], axis=1))
+    return list(map(tuple, np.vstack(init_pairs).tolist()))
 
 
 
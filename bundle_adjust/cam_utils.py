@@ -225,7 +225,38 @@ def apply_rpc_projection(rpc, pts3d):
     Returns:
         pts2d: Nx2 array containing the 2d projections of pts3d given by the RPC model
     """
-    lat, lon, alt = geo_utils.ecef_to_latlon_custom(pts3d[:, 0], pts3d[:, 1], pts3d[:, 2])
+    lat, lon, alt = ecef_to_latlonalt(pts3d)
+    return apply_rpc_projection_to_latlonalt(rpc, lat, lon, alt)
+
+
+def ecef_to_latlonalt(pts3d):
+    """
+    Converts a set of 3d points from ECEF coordinates to latitude, longitude and altitude
+
+    Args:
+        pts3d: Nx3 array of 3d points in ECEF coordinates
+
+    Returns:
+        lat, lon, alt: arrays of length N with the geodetic coordinates of pts3d
+    """
+    return geo_utils.ecef_to_latlon_custom(pts3d[:, 0], pts3d[:, 1], pts3d[:, 2])
+
+
+def apply_rpc_projection_to_latlonalt(rpc, lat, lon, alt, pt_indices=None):
+    """
+    Use rpc model to project a set of 3d points already converted to latitude, longitude and altitude
+    This allows to convert the points once and project different subsets of them with different rpc models
+
+    Args:
+        rpc: RPC model
+        lat, lon, alt: arrays of length N with the geodetic coordinates of the 3d points
+        pt_indices (optional): indices of the subset of points to project, all points are projected if None
+
+    Returns:
+        pts2d: Mx2 array containing the 2d projections of the selected points given by the RPC model
+    """
+    if pt_indices is not None:
+        lat, lon, alt = lat[pt_indices], lon[pt_indices], alt[pt_indices]
     col, row = rpc.projection(lon, lat, alt)
     pts2d = np.vstack((col, row)).T
     return pts2d
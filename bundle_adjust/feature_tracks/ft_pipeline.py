@@ -17,6 +17,7 @@ import os
 import timeit
 
 import numpy as np
+import srtm4
 
 from bundle_adjust import loader, geo_utils
 from . import ft_opencv, ft_s2p, ft_match, ft_utils
@@ -58,10 +59,12 @@ class FeatureTracksPipeline:
 
         # if specified, compute a mask per image to restrict the search of keypoints in an area of interest
         if self.config["FT_kp_aoi"]:
+            # the altitudes of the aoi vertices are the same for all images, so srtm4 is queried only once
+            aoi_alts = srtm4.srtm4(*np.array(self.aoi["coordinates"][0]).T)
             self.mask_paths = []
             for im in self.images:
                 y0, x0, h, w = im.offset["row0"], im.offset["col0"], im.offset["height"], im.offset["width"]
-                mask = loader.get_binary_mask_from_aoi_lonlat_within_image(h, w, im.rpc, self.aoi)
+                mask = loader.get_binary_mask_from_aoi_lonlat_within_image(h, w, im.rpc, self.aoi, alts=aoi_alts)
                 masks_dir = os.path.join(self.output_dir, "masks")
                 os.makedirs(masks_dir, exist_ok=True)
                 mask_path = masks_dir + "/" + loader.get_id(im.geotiff_path) + ".npy"
@@ -107,11 +107,12 @@ def lonlat_geojson_from_geotiff_crop(rpc, crop_offset, z=None):
 
         z = srtm4.srtm4(rpc.lon_offset, rpc.lat_offset)
     col0, row0, w, h = crop_offset["col0"], crop_offset["row0"], crop_offset["width"], crop_offset["height"]
-    cols = [col0, col0, col0 + w, col0 + w, col0]
-    rows = [row0, row0 + h, row0 + h, row0, row0]
-    alts = [z, z, z, z, z]
+    # the 4 corners are localized at once, the first one is then repeated to close the boundary
+    cols = np.array([col0, col0, col0 + w, col0 + w], dtype=float)
+    rows = np.array([row0, row0 + h, row0 + h, row0], dtype=float)
+    alts = np.full(4, z, dtype=float)
     lons, lats = rpc.localization(cols, rows, alts)
-    lonlat_coords = np.vstack((lons, lats)).T
+    lonlat_coords = np.column_stack((lons, lats))[[0, 1, 2, 3, 0]]
     return geojson_polygon(lonlat_coords)
 
 
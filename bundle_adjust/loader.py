@@ -6,15 +6,19 @@ year: 2021
 This script consists of a series of functions dedicated to load and store data on the disk
 """
 
+import functools
 import matplotlib.pyplot as plt
 import numpy as np
 import os
 import shutil
+import struct
 
 import rasterio
 import warnings
 import json
 import rpcm
+import srtm4
+from concurrent.futures import ThreadPoolExecutor
 
 from bundle_adjust import cam_utils, geo_utils
 
@@ -28,10 +32,10 @@ def display_dict(d):
     """
     Displays the input dictionary d
     """
-    max_k_len = len(sorted(d.keys(), key=lambda i: len(i))[::-1][0])
-    for k in d.keys():
-        print("    - {}:{}{}".format(k, "".join([" "] * (max_k_len - len(k) + 2)), d[k]))
-    print("\n")
+    # each key is padded to the length of the longest key (plus the colon and 2 spaces), then printed at once
+    w = max(len(k) for k in d.keys()) + 3
+    lines = ["    - {:<{w}}{}".format(k + ":", v, w=w) for k, v in d.items()]
+    print("\n".join(lines + ["\n"]))
 
 
 def read_image_size(im_fname):
@@ -39,11 +43,123 @@ def read_image_size(im_fname):
     Reads image width and height without opening the file
     useful when dealing with huge images
     """
+    tiff_tags = read_tiff_tags(im_fname, [256, 257])  # 256 = ImageWidth, 257 = ImageLength
+    if 256 in tiff_tags and 257 in tiff_tags:
+        return tiff_tags[257][0], tiff_tags[256][0]
     with rasterio.open(im_fname) as f:
         h, w = f.height, f.width
     return h, w
 
 
+def read_geotiff_size_and_rpc(path_to_geotiff):
+    """
+    Reads image height, width and rpc model of a geotiff with a single access to the file
+    The tiff header is read directly if possible, otherwise the geotiff is opened once with rasterio
+    """
+    tiff_tags = read_tiff_tags(path_to_geotiff, [256, 257, 50844])  # 50844 = RPCCoefficientTag
+    found_tags = 256 in tiff_tags and 257 in tiff_tags and len(tiff_tags.get(50844, [])) == 92
+    if found_tags and not has_rpc_sidecar_file(path_to_geotiff):
+        return tiff_tags[257][0], tiff_tags[256][0], rpc_from_rpc_coefficient_tag(tiff_tags[50844])
+    with rasterio.open(path_to_geotiff) as src:
+        h, w, rpc = src.height, src.width, rpcm.RPCModel(src.tags(ns="RPC"))
+    return h, w, rpc
+
+
+# tiff field types that can be decoded by read_tiff_tags: field type -> (struct format character, size in bytes)
+TIFF_FIELD_TYPES = {1: ("B", 1), 2: ("s", 1), 3: ("H", 2), 4: ("I", 4), 12: ("d", 8), 16: ("Q", 8)}
+# number of bytes fetched at once from the beginning of a tiff (header, first IFD and tag values are usually there)
+TIFF_HEAD_SIZE = 16384
+
+
+def read_tiff_tags(path_to_tiff, tag_ids):
+    """
+    Reads the values of some tags from the first image file directory (IFD) of a tiff or bigtiff file
+    Only the header, the IFD and the values of the requested tags are read, the geotiff metadata is not parsed
+    Returns a dictionary with the tags of tag_ids that were found (ascii values as strings, other values as tuples)
+    If the file is not a tiff an empty dictionary is returned
+    """
+    tag_values = {}
+    with open(path_to_tiff, "rb") as f:
+
+        # the first bytes of the file are read in a single call, the file is only accessed again
+        # if some of the requested data is located after them
+        head = f.read(TIFF_HEAD_SIZE)
+
+        def read_bytes(offset, n_bytes):
+            if offset + n_bytes <= len(head):
+                return head[offset : offset + n_bytes]
+            f.seek(offset)
+            return f.read(n_bytes)
+
+        byte_order = {b"II": "<", b"MM": ">"}.get(head[:2])
+        if byte_order is None or len(head) < 16:
+            return tag_values
+        version = struct.unpack(byte_order + "H", head[2:4])[0]
+        if version == 42:
+            ifd_offset = struct.unpack(byte_order + "I", head[4:8])[0]
+            count_fmt, entry_fmt, offset_fmt = "H", "HHI", "I"
+        elif version == 43:
+            ifd_offset = struct.unpack(byte_order + "Q", head[8:16])[0]
+            count_fmt, entry_fmt, offset_fmt = "Q", "HHQ", "Q"
+        else:
+            return tag_values
+
+        # read the whole IFD at once (each entry = tag, field type, number of values, value or offset to value)
+        count_size = struct.calcsize(count_fmt)
+        n_entries = struct.unpack(byte_order + count_fmt, read_bytes(ifd_offset, count_size))[0]
+        value_size = struct.calcsize(offset_fmt)
+        entry_size = struct.calcsize(byte_order + entry_fmt) + value_size
+        ifd = read_bytes(ifd_offset + count_size, n_entries * entry_size)
+
+        for i in range(len(ifd) // entry_size):
+            entry = ifd[i * entry_size : (i + 1) * entry_size]
+            tag, field_type, n_values = struct.unpack_from(byte_order + entry_fmt, entry)
+            if tag not in tag_ids or field_type not in TIFF_FIELD_TYPES:
+                continue
+            fmt_char, type_size = TIFF_FIELD_TYPES[field_type]
+            n_bytes = n_values * type_size
+            if n_bytes <= value_size:
+                raw_value = entry[-value_size:][:n_bytes]
+            else:
+                raw_value = read_bytes(struct.unpack(byte_order + offset_fmt, entry[-value_size:])[0], n_bytes)
+            if field_type == 2:
+                tag_values[tag] = raw_value.split(b"\x00")[0].decode("ascii", errors="replace")
+            else:
+                tag_values[tag] = struct.unpack("{}{}{}".format(byte_order, n_values, fmt_char), raw_value)
+    return tag_values
+
+
+def find_rpc_sidecar_files(path_to_geotiff):
+    """
+    Returns the paths to the sidecar rpc files (.RPB, _RPC.TXT or .rpc) of a geotiff that exist on the disk
+    GDAL reads these files instead of the rpc stored in the tiff tags
+    """
+    base = os.path.splitext(path_to_geotiff)[0]
+    suffixes = [".RPB", ".rpb", "_RPC.TXT", "_rpc.txt", ".RPC", ".rpc"]
+    return [base + suffix for suffix in suffixes if os.path.exists(base + suffix)]
+
+
+def has_rpc_sidecar_file(path_to_geotiff):
+    """
+    Checks if a geotiff has a sidecar rpc file, which GDAL reads instead of the rpc stored in the tiff tags
+    """
+    return len(find_rpc_sidecar_files(path_to_geotiff)) > 0
+
+
+def rpc_from_rpc_coefficient_tag(rpc_coefficients):
+    """
+    Builds a rpc model from the 92 values of the RPCCoefficientTag (50844) of a geotiff, as written by GDAL:
+    error bias, error random, 5 offsets (line, sample, lat, lon, height), 5 scales (same order)
+    and the 20 coefficients of the line numerator, line denominator, sample numerator and sample denominator
+    """
+    keys = ["LINE_OFF", "SAMP_OFF", "LAT_OFF", "LONG_OFF", "HEIGHT_OFF"]
+    keys += ["LINE_SCALE", "SAMP_SCALE", "LAT_SCALE", "LONG_SCALE", "HEIGHT_SCALE"]
+    rpc_dict = dict(zip(keys, rpc_coefficients[2:12]))
+    for i, k in enumerate(["LINE_NUM_COEFF", "LINE_DEN_COEFF", "SAMP_NUM_COEFF", "SAMP_DEN_COEFF"]):
+        rpc_dict[k] = " ".join([str(c) for c in rpc_coefficients[12 + 20 * i : 32 + 20 * i]])
+    return rpcm.RPCModel(rpc_dict, dict_format="geotiff")
+
+
 def get_time_in_hours_mins_secs(input_seconds):
     """
     Takes a float representing a time measure in seconds
@@ -54,6 +170,7 @@ def get_time_in_hours_mins_secs(input_seconds):
     return "{:0>2}:{:0>2}:{:05.2f}".format(int(hours), int(minutes), seconds)
 
 
+@functools.lru_cache(maxsize=None)
 def add_suffix_to_fname(src_fname, suffix):
     """
     Adds a string suffix at the end of the src_fname path to file, keeping the file extension
@@ -64,6 +181,7 @@ def add_suffix_to_fname(src_fname, suffix):
     return dst_fname
 
 
+@functools.lru_cache(maxsize=None)
 def get_id(fname):
     """
     Gets the basename without extension of a path to file
@@ -71,6 +189,35 @@ def get_id(fname):
     return os.path.splitext(os.path.basename(fname))[0]
 
 
+def find_files(root_dir, extension, label=None):
+    """
+    Recursively yields the paths to the files in root_dir (and its subdirectories) ending with extension
+    If label is not None, only the paths containing label are yielded
+    Hidden files and directories are skipped, as with glob
+    """
+    dirs_to_visit = [root_dir]
+    while dirs_to_visit:
+        with os.scandir(dirs_to_visit.pop()) as it:
+            for entry in it:
+                if entry.name.startswith("."):
+                    continue
+                if entry.is_dir():
+                    dirs_to_visit.append(entry.path)
+                elif entry.name.endswith(extension) and (label is None or label in entry.path):
+                    yield entry.path
+
+
+def map_in_threads(func, *iterables):
+    """
+    Applies func to the items of the input iterables using a pool of threads, useful for I/O bound tasks
+    Returns the list of outputs, in the same order as the input items
+    """
+    args = list(zip(*iterables))
+    n_workers = max(1, min(32, 4 * (os.cpu_count() or 1), len(args)))
+    with ThreadPoolExecutor(max_workers=n_workers) as executor:
+        return list(executor.map(lambda a: func(*a), args))
+
+
 def save_dict_to_json(input_dict, output_json_fname):
     """
     Saves a python dictionary to a .json file
@@ -94,6 +241,13 @@ def load_geotiff_lonlat_footprints(geotiff_paths, rpcs=None, crop_offsets=None):
     If the rpcs are not specified in the input, they will be read from the geotiffs
     Outputs a list of geojson polygons delimiting the geographic footprint of the images in lon-lat coordinates
     """
+    if crop_offsets is None and rpcs is None:
+        # image size and rpc are read at once
+        crop_offsets, rpcs = [], []
+        for path_to_geotiff in geotiff_paths:
+            h, w, rpc = read_geotiff_size_and_rpc(path_to_geotiff)
+            crop_offsets.append({"col0": 0.0, "row0": 0.0, "width": w, "height": h})
+            rpcs.append(rpc)
     if crop_offsets is None:
         crop_offsets = []
         for path_to_geotiff in geotiff_paths:
@@ -104,19 +258,17 @@ def load_geotiff_lonlat_footprints(geotiff_paths, rpcs=None, crop_offsets=None):
 
     lonlat_geotiff_footprints = []
     # get srtm4 of the middle point in each geotiff crop
-    import srtm4
-
     lonslats = np.array([[rpc.lon_offset, rpc.lat_offset] for rpc in rpcs])
     alts = srtm4.srtm4(lonslats[:, 0], lonslats[:, 1])
     fails = 0
-    import warnings
-
-    warnings.filterwarnings("ignore")
-    for im_idx, (rpc, offset) in enumerate(zip(rpcs, crop_offsets)):
-        try:
-            lonlat_geotiff_footprints.append(geo_utils.lonlat_geojson_from_geotiff_crop(rpc, offset, z=alts[im_idx]))
-        except:
-            fails += 1
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        for im_idx, (rpc, offset) in enumerate(zip(rpcs, crop_offsets)):
+            try:
+                footprint = geo_utils.lonlat_geojson_from_geotiff_crop(rpc, offset, z=alts[im_idx])
+                lonlat_geotiff_footprints.append(footprint)
+            except:
+                fails += 1
     if fails > 0:
         args = [fails, len(geotiff_paths)]
         print("\nWARNING: {}/{} fails loading geotiff footprints (rpc localization max iter error)\n".format(*args))
@@ -151,20 +303,24 @@ def mask_from_shapely_polygons(polygons, im_size):
     return img_mask
 
 
-def get_binary_mask_from_aoi_lonlat_within_image(height, width, geotiff_rpc, aoi_lonlat):
+def get_binary_mask_from_aoi_lonlat_within_image(height, width, geotiff_rpc, aoi_lonlat, alts=None):
     """
     Computes a binary mask of an area of interest within the limits of a geotiff image
     with 1 in those points inside the area of interest and 0 in those points outisde of it
+    The srtm4 altitudes of the aoi vertices can be passed in alts to avoid querying them again for each image
     """
-    import srtm4
-
     lons, lats = np.array(aoi_lonlat["coordinates"][0]).T
-    alts = srtm4.srtm4(lons, lats)
+    if alts is None:
+        alts = srtm4.srtm4(lons, lats)
     cols, rows = geotiff_rpc.projection(lons, lats, alts)
-    poly_verts_colrow = np.vstack((cols, rows)).T
+    poly_verts_colrow = np.column_stack((cols, rows))
     geojson_poly = geo_utils.geojson_polygon(poly_verts_colrow)
-    shapely_poly = geo_utils.geojson_to_shapely_polygon(geojson_poly)
-    mask = mask_from_shapely_polygons([shapely_poly], (height, width))
+
+    # rasterize the polygon vertices directly, there is no need to build a shapely polygon for it
+    import cv2
+
+    mask = np.zeros((height, width), np.uint8)
+    cv2.fillPoly(mask, [np.array(geojson_poly["coordinates"][0]).round().astype(np.int32)], 1)
     return mask
 
 
@@ -180,9 +336,12 @@ def custom_equalization(im, mask=None, clip=True, percentiles=5):
         mi, ma = np.percentile(im[valid_domain], (percentiles, 100 - percentiles))
     else:
         mi, ma = im[valid_domain].min(), im[valid_domain].max()
-    im = np.minimum(np.maximum(im, mi), ma)  # clip
-    im = (im - mi) / (ma - mi) * 255.0  # scale
-    return im
+    # clip and scale in a single float32 buffer, to avoid full size temporaries
+    im_eq = np.empty(im.shape, dtype=np.float32)
+    np.clip(im, mi, ma, out=im_eq, casting="unsafe")  # clip
+    im_eq -= mi
+    im_eq *= 255.0 / (ma - mi)  # scale
+    return im_eq
 
 
 def load_image(path_to_geotiff, offset=None, equalize=False):
@@ -190,13 +349,13 @@ def load_image(path_to_geotiff, offset=None, equalize=False):
     Reads an input geotiff
     It is possible to specify a window to read a specific region of the image
     """
-    if offset is None:
-        with rasterio.open(path_to_geotiff) as src:
-            im = src.read().astype(np.float)
-    else:
+    window = None
+    if offset is not None:
         y0, x0, h, w = offset["row0"], offset["col0"], offset["height"], offset["width"]
-        with rasterio.open(path_to_geotiff) as src:
-            im = src.read(window=((y0, y0 + h), (x0, x0 + w))).squeeze().astype(np.float)
+        window = rasterio.windows.Window(int(x0), int(y0), int(w), int(h))
+    # the pixels are read directly as float32, without an intermediate copy in the native dtype
+    with rasterio.open(path_to_geotiff) as src:
+        im = src.read(window=window, out_dtype=np.float32).squeeze()
 
     # we only work with 1-band images
     if len(im.shape) > 2:
@@ -213,15 +372,14 @@ def load_offsets(rpcs, aoi):
     i.e. aoi_as_seen_in_image = image[row0: row0 + height, col0 : col0 + width]
     """
 
+    # get the altitude of the center of the AOI (the same for all rpcs)
+    lon, lat = aoi["center"]
+    alt = srtm4.srtm4(lon, lat)
+    lons, lats = np.array(aoi["coordinates"][0]).T
+
     offsets = []
     for rpc in rpcs:
-        # get the altitude of the center of the AOI
-        import srtm4
-
-        lon, lat = aoi["center"]
-        alt = srtm4.srtm4(lon, lat)
         # project aoi and crop
-        lons, lats = np.array(aoi["coordinates"][0]).T
         x, y = rpc.projection(lons, lats, alt)
         x_min, x_max, y_min, y_max = min(x), max(x), min(y), max(y)
         x0, y0, w, h = int(x_min), int(y_min), int(x_max - x_min), int(y_max - y_min)
@@ -233,20 +391,20 @@ def save_rpcs(filenames, rpcs):
     """
     Writes a series of rpc models to the specified filenames
     """
-    for fn, rpc in zip(filenames, rpcs):
-        os.makedirs(os.path.dirname(fn), exist_ok=True)
-        rpc.write_to_file(fn)
+    for dirname in set(os.path.dirname(fn) for fn in filenames):
+        os.makedirs(dirname, exist_ok=True)
+    map_in_threads(lambda fn, rpc: rpc.write_to_file(fn), filenames, rpcs)
 
 
 def load_rpcs_from_dir(image_fnames_list, rpc_dir, suffix="", extension="rpc", verbose=True):
     """
     Loads rpcs from rpc files stored in a common directory
     """
-    rpcs = []
-    for im_idx, fname in enumerate(image_fnames_list):
+    rpc_paths = []
+    for fname in image_fnames_list:
         rpc_basename = "{}.{}".format(get_id(add_suffix_to_fname(fname, suffix)), extension)
-        path_to_rpc = os.path.join(rpc_dir, rpc_basename)
-        rpcs.append(rpcm.rpc_from_rpc_file(path_to_rpc))
+        rpc_paths.append(os.path.join(rpc_dir, rpc_basename))
+    rpcs = map_in_threads(rpcm.rpc_from_rpc_file, rpc_paths)
     if verbose:
         flush_print("Loaded {} rpcs".format(len(image_fnames_list)))
     return rpcs
@@ -268,15 +426,35 @@ def save_projection_matrices(filenames, projection_matrices, crop_offsets):
         save_dict_to_json(to_write, fn)
 
 
-def load_matrices_from_dir(image_fnames_list, P_dir, suffix="pinhole_adj", verbose=True):
+def load_matrices_and_offsets_from_dir(image_fnames_list, P_dir, suffix="pinhole_adj", verbose=True):
     """
-    Loads projection matrices from json files stored in a common directory
+    Loads projection matrices and crop offsets from json files stored in a common directory
+    Each json file, as written by save_projection_matrices, is read and parsed only once
     """
-    proj_matrices = []
-    for im_idx, fname in enumerate(image_fnames_list):
+    proj_matrices, crop_offsets = [], []
+    for fname in image_fnames_list:
         path_to_P = os.path.join(P_dir, "{}_{}.json".format(get_id(fname), suffix))
-        P = load_dict_from_json(path_to_P)["P"]
+        d = load_dict_from_json(path_to_P)
+        P = np.array(d["P"], dtype=np.float64)
         proj_matrices.append(P / P[2, 3])
+        crop_offsets.append(
+            {
+                "col0": d["col_offset"],
+                "row0": d["row_offset"],
+                "width": d["width"],
+                "height": d["height"],
+            }
+        )
+    if verbose:
+        print("Loaded {} projection matrices and crop offsets".format(len(image_fnames_list)))
+    return proj_matrices, crop_offsets
+
+
+def load_matrices_from_dir(image_fnames_list, P_dir, suffix="pinhole_adj", verbose=True):
+    """
+    Loads projection matrices from json files stored in a common directory
+    """
+    proj_matrices, _ = load_matrices_and_offsets_from_dir(image_fnames_list, P_dir, suffix=suffix, verbose=False)
     if verbose:
         print("Loaded {} projection matrices".format(len(image_fnames_list)))
     return proj_matrices
@@ -286,18 +464,7 @@ def load_offsets_from_dir(image_fnames_list, P_dir, suffix="pinhole_adj", verbos
     """
     Loads offsets from json files stored in a common directory
     """
-    crop_offsets = []
-    for im_idx, fname in enumerate(image_fnames_list):
-        path_to_P = os.path.join(P_dir, "{}_{}.json".format(get_id(fname), suffix))
-        d = load_dict_from_json(path_to_P)
-        crop_offsets.append(
-            {
-                "col0": d["col_offset"],
-                "row0": d["col_offset"],
-                "width": d["width"],
-                "height": d["height"],
-            }
-        )
+    _, crop_offsets = load_matrices_and_offsets_from_dir(image_fnames_list, P_dir, suffix=suffix, verbose=False)
     if verbose:
         print("Loaded {} crop offsets".format(len(image_fnames_list)))
     return crop_offsets
@@ -306,17 +473,16 @@ def load_offsets_from_dir(image_fnames_list, P_dir, suffix="pinhole_adj", verbos
 def save_list_of_pairs(path_to_npy, list_of_pairs):
     """
     Save a list of pairs to a .npy file
-    list of pairs is a list of tuples, but is saved as a 2d array with 2 columns (one row per pair)
+    list of pairs is a list of tuples, but is saved as a 2d int32 array with 2 columns (one row per pair)
     """
-    np.save(path_to_npy, np.array(list_of_pairs))
+    np.save(path_to_npy, np.array(list_of_pairs, dtype=np.int32).reshape(-1, 2))
 
 
 def load_list_of_pairs(path_to_npy):
     """
     Opposite operation of save_list_of_pairs
     """
-    array_t = np.load(path_to_npy).T.astype(int)
-    return list(zip(array_t[0], array_t[1]))
+    return list(map(tuple, np.load(path_to_npy).reshape(-1, 2).tolist()))
 
 
 def save_list_of_paths(path_to_txt, list_of_paths):
@@ -46,3 +46,40 @@ def test_ba():
 
         for k in rpc.keys():
             assert np.allclose(rpc[k], rpc_comp[k])
+
+
+def test_scene_index(tmp_path, capsys):
+
+    out_dir = os.path.join(str(tmp_path), "outdir")
+    scene_config = {
+        "geotiff_dir": "tests/data/images",
+        "rpc_dir": "tests/data/images",
+        "rpc_src": "txt",
+        "output_dir": out_dir,
+    }
+    cfg_path = os.path.join(str(tmp_path), "config.json")
+    json.dump(scene_config, open(cfg_path, "w"))
+
+    def load_scene_and_init_rpcs():
+        scene = bundle_adjust.ba_timeseries.Scene(cfg_path)
+        rpc_paths = sorted(glob.glob(os.path.join(out_dir, "rpcs_init", "*.rpc")))
+        return scene, [rpcm.rpc_from_rpc_file(p).__dict__ for p in rpc_paths]
+
+    # the first scene writes the index, the second one reads the geotiff metadata from it
+    scene1, rpcs1 = load_scene_and_init_rpcs()
+    assert "Geotiff metadata loaded" not in capsys.readouterr().out
+    assert os.path.exists(os.path.join(out_dir, "scene_index.json"))
+    scene2, rpcs2 = load_scene_and_init_rpcs()
+    assert "Geotiff metadata loaded" in capsys.readouterr().out
+
+    assert scene1.timeline == scene2.timeline
+    assert len(rpcs1) == len(rpcs2) == 2
+    for rpc1, rpc2 in zip(rpcs1, rpcs2):
+        for k in rpc1.keys():
+            assert np.allclose(rpc1[k], rpc2[k])
+
+    # a malformed index is ignored and rewritten
+    json.dump([1, 2, 3], open(os.path.join(out_dir, "scene_index.json"), "w"))
+    scene3, _ = load_scene_and_init_rpcs()
+    assert "Geotiff metadata loaded" not in capsys.readouterr().out
+    assert scene3.timeline == scene1.timeline
@@ -1,4 +1,10 @@
+import datetime
+import shutil
+
 import numpy as np
+import rasterio
+import rasterio.shutil
+import rpcm
 
 from bundle_adjust.ba_rotate import (
     R_to_quaternion,
@@ -14,6 +20,20 @@ from bundle_adjust.cam_utils import (
     decompose_affine_camera,
     decompose_perspective_camera,
 )
+from bundle_adjust.ba_timeseries import (
+    FAST_DATETIME_FORMATS,
+    get_acquisition_date,
+    get_acquisition_date_from_filename,
+    parse_datetime,
+)
+from bundle_adjust.loader import (
+    has_rpc_sidecar_file,
+    load_matrices_and_offsets_from_dir,
+    load_offsets_from_dir,
+    read_tiff_tags,
+    rpc_from_rpc_coefficient_tag,
+    save_projection_matrices,
+)
 
 
 def test_camera_utils():
@@ -61,3 +81,93 @@ def test_ba_rotate():
     # conversion between quaternion and rotation matrix failed
     assert np.allclose(R, quaternion_to_R(*R_to_quaternion(R)))
     # conversion between axis-angle and rotation matrix failed
+
+
+def test_projection_matrices_io(tmp_path):
+    image_fnames = ["{}/im{}.tif".format(tmp_path, i) for i in range(3)]
+    P = [np.random.rand(3, 4) for _ in image_fnames]
+    offsets = [{"col0": 10 * i, "row0": 20 * i + 5, "width": 100, "height": 200} for i in range(3)]
+    json_fnames = ["{}/P/im{}_pinhole_adj.json".format(tmp_path, i) for i in range(3)]
+    save_projection_matrices(json_fnames, P, offsets)
+
+    # the loaded matrices are normalized by P[2, 3] and the crop offsets are preserved
+    P_loaded, offsets_loaded = load_matrices_and_offsets_from_dir(image_fnames, "{}/P".format(tmp_path))
+    assert all(np.allclose(P_loaded[i], P[i] / P[i][2, 3]) for i in range(3))
+    assert offsets_loaded == offsets
+    assert load_offsets_from_dir(image_fnames, "{}/P".format(tmp_path)) == offsets
+
+
+def test_read_tiff_tags(tmp_path):
+    # the test images have a .rpc sidecar file, so they are copied without it to read the rpc from the tiff tags
+    tif_path = str(tmp_path / "im.tif")
+    shutil.copy("tests/data/images/20200413_151408_ssc4d2_0011_basic_panchromatic_dn.tif", tif_path)
+    bigtif_path = str(tmp_path / "im_bigtiff.tif")
+    rasterio.shutil.copy(tif_path, bigtif_path, driver="GTiff", BIGTIFF="YES")
+
+    for path in [tif_path, bigtif_path]:
+        assert not has_rpc_sidecar_file(path)
+        tags = read_tiff_tags(path, [256, 257, 306, 50844])
+        with rasterio.open(path) as src:
+            assert tags[256] == (src.width,)
+            assert tags[257] == (src.height,)
+            assert tags[306] == src.tags()["TIFFTAG_DATETIME"]
+
+        # the rpc decoded from the RPCCoefficientTag is the same as the one read by gdal
+        rpc = rpc_from_rpc_coefficient_tag(tags[50844]).__dict__
+        rpc_gdal = rpcm.rpc_from_geotiff(path).__dict__
+        assert rpc.keys() == rpc_gdal.keys()
+        for k in rpc_gdal.keys():
+            assert np.allclose(rpc[k], rpc_gdal[k])
+
+    # non tiff files have no tags
+    assert read_tiff_tags("tests/data/images/20200413_151408_ssc4d2_0011_basic_panchromatic_dn.rpc", [256]) == {}
+
+
+def test_parse_datetime():
+    dt = datetime.datetime(2020, 4, 13, 15, 14, 8, 123456)
+    for date_format in FAST_DATETIME_FORMATS.keys():
+        date_string = dt.strftime(date_format)
+        assert parse_datetime(date_string, date_format) == datetime.datetime.strptime(date_string, date_format)
+
+    # fractions of second with less than 6 digits are read by the fast path as strptime does
+    assert parse_datetime("20200413151408123", "%Y%m%d%H%M%S%f") == datetime.datetime(2020, 4, 13, 15, 14, 8, 123000)
+
+    # strings that do not have the fixed-width shape of the format fall back to strptime
+    # a 14-digit stamp has no fraction of second, so strptime reads it loosely with %f (this is why
+    # the filename dates without fraction are parsed with %Y%m%d%H%M%S)
+    assert parse_datetime("20120225002559", "%Y%m%d%H%M%S%f") == datetime.datetime(2012, 2, 25, 0, 25, 5, 900000)
+    assert parse_datetime("20120225002559", "%Y%m%d%H%M%S") == datetime.datetime(2012, 2, 25, 0, 25, 59)
+    assert parse_datetime("2020-4-13 15:14:08.5", "%Y-%m-%d %H:%M:%S.%f") == datetime.datetime(
+        2020, 4, 13, 15, 14, 8, 500000
+    )
+
+
+def test_acquisition_date_from_filename(tmp_path):
+    expected_dates = {
+        # Pleiades, the stamp has a tenth of second digit
+        "IMG_PHR1A_P_201202250025599_SEN_PRG_FC_5847-001_R1C1.TIF": datetime.datetime(2012, 2, 25, 0, 25, 59, 900000),
+        # Pleiades, 14-digit stamp without fraction of second
+        "IMG_PHR1B_P_20120225002559_SEN_PRG_FC_5847-001_R1C1.TIF": datetime.datetime(2012, 2, 25, 0, 25, 59),
+        # Pleiades Neo, panchromatic
+        "IMG_PNEO3_202107271120369_PAN_SEN_PWOI_000028512_1_1_F_1_P_R1C1.TIF": datetime.datetime(
+            2021, 7, 27, 11, 20, 36, 900000
+        ),
+        # Pleiades Neo, non panchromatic products do not follow the convention
+        "IMG_PNEO3_202107271120369_MS-FS_SEN_PWOI_000028512_1_1_F_1_P_R1C1.TIF": None,
+        # Skysat
+        "20200413_151408_ssc4d2_0011_basic_panchromatic_dn.tif": datetime.datetime(2020, 4, 13, 15, 14, 8),
+        # other names
+        "image_0011.tif": None,
+    }
+    for fname, expected_date in expected_dates.items():
+        assert get_acquisition_date_from_filename("/some/dir/" + fname) == expected_date
+
+    # the date in the filename takes precedence over TIFFTAG_DATETIME (2020:04:13 15:14:08 in the test image)
+    # and the tag is used if the filename does not follow any convention
+    src_path = "tests/data/images/20200413_151408_ssc4d2_0011_basic_panchromatic_dn.tif"
+    for fname in ["IMG_PHR1A_P_201202250025599_SEN_PRG_FC_5847-001_R1C1.tif", "image_0011.tif"]:
+        shutil.copy(src_path, str(tmp_path / fname))
+    assert get_acquisition_date(str(tmp_path / "IMG_PHR1A_P_201202250025599_SEN_PRG_FC_5847-001_R1C1.tif")) == (
+        datetime.datetime(2012, 2, 25, 0, 25, 59, 900000)
+    )
+    assert get_acquisition_date(str(tmp_path / "image_0011.tif")) == datetime.datetime(2020, 4, 13, 15, 14, 8)